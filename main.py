@@ -1,10 +1,96 @@
 import json
+import queue
+import threading
 import time
 import numpy as np
+import pyfftw
+import scipy.fft as sfft
 import sounddevice as sd
+from numba import njit
 from pynput.keyboard import Controller as KeyController
 from pynput.mouse import Controller as MouseController, Button
-from collections import deque
+
+
+@njit(cache=True)
+def _ring_write(ring, pos, samples):
+    for i in range(samples.size):
+        ring[pos] = samples[i]
+        pos += 1
+        if pos == ring.size:
+            pos = 0
+    return pos
+
+
+@njit(fastmath=True, cache=True)
+def _apply_window(ring, pos, window, out):
+    tail = ring.size - pos
+    for i in range(tail):
+        out[i] = ring[pos + i] * window[i]
+    for i in range(pos):
+        out[tail + i] = ring[i] * window[tail + i]
+
+
+@njit(fastmath=True, cache=True)
+def _mag2(spectrum, out):
+    for i in range(out.size):
+        c = spectrum[i]
+        out[i] = c.real*c.real + c.imag*c.imag
+
+
+@njit(cache=True)
+def _peak_and_neighbors(mag, lo, hi):
+    idx = lo
+    for i in range(lo + 1, hi):
+        if mag[i] > mag[idx]:
+            idx = i
+    return idx, mag[idx-1], mag[idx], mag[idx+1]
+
+
+@njit(cache=True)
+def _closest_note(freqs, harmonics, f):
+    closest_idx = -1
+    closest_cents = np.inf
+    for i in range(freqs.size):
+        note_freq = freqs[i]
+        for j in range(harmonics.size):
+            if abs(f - note_freq*harmonics[j]) < 10:
+                return i
+        cents = abs(1200.0 * np.log2(note_freq / f))
+        if cents < closest_cents:
+            closest_cents = cents
+            closest_idx = i
+    return closest_idx if closest_cents < 50 else -1
+
+
+@njit(cache=True)
+def _detect_note(spectrum, mag, lo, hi, bin_hz, thresh, freqs, harmonics):
+    _mag2(spectrum, mag)
+    peak_bin, m_lo, peak_power, m_hi = _peak_and_neighbors(mag, lo, hi)
+    if peak_power < thresh:
+        return -2
+    freq = peak_bin * bin_hz
+    if 1 < peak_bin < mag.size-1:
+        y0 = np.log(m_lo + 1e-30)
+        y1 = np.log(peak_power + 1e-30)
+        y2 = np.log(m_hi + 1e-30)
+        denom = y0 - 2*y1 + y2
+        if denom != 0:
+            delta = (y0 - y2) / (2*denom)
+            freq = (peak_bin + delta) * bin_hz
+    if freqs.size == 0 or freq < 50 or freq > 1000:
+        return -1
+    return _closest_note(freqs, harmonics, freq)
+
+
+@njit(nogil=True, cache=True)
+def _bars(spectrum, bands, band_size, out):
+    for i in range(bands):
+        s = 0.0
+        base = i*band_size
+        for j in range(band_size):
+            s += np.log(spectrum[base + j] + 1e-10)
+        out[i] = int(2.0*s/band_size)
+
 
 class GuitarHeroController:
     def __init__(self, config_path="config.json"):
@@ -12,8 +98,7 @@ class GuitarHeroController:
         self.device_index = self.select_input_device()
         self.setup_audio_processing()
         self.setup_controllers()
-        self.window = np.blackman(self.chunk_size)
-        self.freq_history = deque(maxlen=10)
+        self.setup_visualizer()
         self.note_display = {
             82.41: ("E2", "W [↑]", "↑"),
             110.0: ("A2", "S [↓]", "↓"),
@@ -22,14 +107,23 @@ class GuitarHeroController:
             246.94: ("B3", "LMB [⚔]", "⚔"),
             329.63: ("E4", "RMB [🛡]", "🛡")
         }
-        self.active_actions = set()
-        self.spectrum = []
-        self.last_print = time.time()
+        self._active_mask = 0
+        self.last_print = float("-inf")
 
     def load_config(self, path):
         with open(path, "r") as f:
             self.config = json.load(f)
         self.note_map = {params["freq"]: params for params in self.config["note_bindings"].values()}
+        self._note_keys = sorted(self.note_map.keys())
+        self._note_freqs = np.array(self._note_keys, dtype=np.float32)
+        self._harmonics = np.array([2.0, 3.0, 0.5], dtype=np.float32)
+        self._action_bits = {}
+        self._action_by_bit = []
+        for params in self.note_map.values():
+            action = (params["type"], params["action"])
+            if action not in self._action_bits:
+                self._action_bits[action] = len(self._action_by_bit)
+                self._action_by_bit.append(action)
         self.detection_thresh = self.config["audio_settings"]["detection_threshold"]
         print("🎸 Гитарный контроллер инициализирован!")
 
@@ -55,7 +149,32 @@ class GuitarHeroController:
         device_info = sd.query_devices(self.device_index)
         self.sample_rate = int(audio_cfg.get("sample_rate", device_info["default_samplerate"]))
         self.chunk_size = audio_cfg["chunk_size"]
+        analysis_size = audio_cfg.get("analysis_size", self.chunk_size)
+        self.analysis_size = sfft.next_fast_len(analysis_size, real=True)
+        if self.analysis_size != analysis_size:
+            print(f"📐 Размер окна анализа округлён: {analysis_size} -> {self.analysis_size}")
+        self.analysis_hop = audio_cfg.get("analysis_hop", 1)
+        self._ring = np.zeros(self.analysis_size, dtype=np.float32)
+        self._ring_pos = 0
+        self._blocks_since_fft = 0
         self.silence_thresh = audio_cfg["silence_threshold"]
+        self._fft_in = pyfftw.empty_aligned(self.analysis_size, dtype="float32")
+        self._fft_out = pyfftw.empty_aligned(self.analysis_size//2 + 1, dtype="complex64")
+        self._fft = pyfftw.FFTW(self._fft_in, self._fft_out, flags=("FFTW_MEASURE", "FFTW_DESTROY_INPUT"), threads=1)
+        self._mag = np.empty(self.analysis_size//2 + 1, dtype=np.float32)
+        min_freq = 50
+        self._min_bin = max(1, int(min_freq * self.analysis_size / self.sample_rate))
+        self._max_bin = int(len(self._mag)*0.8)
+        self._bin_hz = self.sample_rate / self.analysis_size
+        self.window = (np.blackman(self.analysis_size) * np.iinfo(np.int16).max).astype(np.float32)
+        silence = np.zeros((self.chunk_size, 1), dtype=np.float32)
+        self._ring_pos = _ring_write(self._ring, self._ring_pos, silence[:, 0])
+        _apply_window(self._ring, self._ring_pos, self.window, self._fft_in)
+        self._fft()
+        _detect_note(
+            self._fft_out, self._mag, self._min_bin, self._max_bin, self._bin_hz,
+            self.detection_thresh, self._note_freqs, self._harmonics
+        )
         self.stream = sd.InputStream(
             device=self.device_index,
             channels=1,
@@ -69,90 +188,86 @@ class GuitarHeroController:
     def setup_controllers(self):
         self.keyboard = KeyController()
         self.mouse = MouseController()
+        self._btn = {'left': Button.left, 'right': Button.right}
         print("🎮 Контроллеры подключены")
 
+    def setup_visualizer(self):
+        self._viz_q = queue.Queue(maxsize=4)
+        self._viz_bars = np.empty(30, dtype=np.int32)
+        _bars(np.zeros_like(self._mag), len(self._viz_bars), 1, self._viz_bars)
+        self._viz_thread = threading.Thread(target=self.visualizer_loop, daemon=True)
+        self._viz_thread.start()
+
+    def visualizer_loop(self):
+        while True:
+            render, arg = self._viz_q.get()
+            render(arg)
+
+    def post_output(self, render, arg):
+        try:
+            self._viz_q.put_nowait((render, arg))
+        except queue.Full:
+            pass
+
     def process_audio(self, indata, frames, time_info, status):
-        audio_data = indata[:, 0] * np.iinfo(np.int16).max
-        audio_data = audio_data.astype(np.float32)
-        windowed = audio_data * self.window
-        fft = np.fft.rfft(windowed)
-        magnitudes = np.abs(fft) ** 2
-        min_freq = 50
-        min_bin = int(min_freq * self.chunk_size / self.sample_rate)
-        min_bin = max(1, min_bin)
-        spectrum_segment = magnitudes[min_bin:int(len(magnitudes)*0.8)]
-        peak_bin = np.argmax(spectrum_segment) + min_bin
-        peak_power = magnitudes[peak_bin]
-        if peak_power < self.detection_thresh:
+        self._ring_pos = _ring_write(self._ring, self._ring_pos, indata[:, 0])
+        self._blocks_since_fft += 1
+        if self._blocks_since_fft < self.analysis_hop:
+            return
+        self._blocks_since_fft = 0
+        _apply_window(self._ring, self._ring_pos, self.window, self._fft_in)
+        self._fft()
+        idx = _detect_note(
+            self._fft_out, self._mag, self._min_bin, self._max_bin, self._bin_hz,
+            self.detection_thresh, self._note_freqs, self._harmonics
+        )
+        if idx == -2:
             self.release_actions()
             return
-        freq = peak_bin * self.sample_rate / self.chunk_size
-        self.freq_history.append(freq)
-        if 1 < peak_bin < len(magnitudes)-1:
-            y0, y1, y2 = np.log(magnitudes[peak_bin-1:peak_bin+2])
-            delta = (y0 - y2) / (2*(y0 - 2*y1 + y2))
-            refined_freq = (peak_bin + delta) * self.sample_rate / self.chunk_size
-            freq = refined_freq
-        detected_note = self.find_closest_note(freq)
-        self.spectrum = magnitudes
-        if time.time() - self.last_print > 0.1:
-            self.visualize_spectrum()
-            self.last_print = time.time()
-        if detected_note:
+        now = time_info.currentTime or time.monotonic()
+        if now - self.last_print > 0.1:
+            self.post_output(self.visualize_spectrum, self._mag.copy())
+            self.last_print = now
+        if idx >= 0:
+            detected_note = self._note_keys[idx]
             self.trigger_action(detected_note)
-            self.display_note(detected_note)
+            self.post_output(self.display_note, detected_note)
         else:
             self.release_actions()
 
-    def find_closest_note(self, freq):
-        frequencies = np.array(list(self.note_map.keys()))
-        if frequencies.size == 0 or freq < 50 or freq > 1000:
-            return None
-        ratios = frequencies / freq
-        cents = 1200 * np.log2(ratios)
-        closest_idx = np.argmin(np.abs(cents))
-        for i, note_freq in enumerate(frequencies):
-            for harmonic in [2, 3, 0.5]:
-                if abs(freq - note_freq*harmonic) < 10:
-                    return note_freq
-        return frequencies[closest_idx] if abs(cents[closest_idx]) < 50 else None
-
-    def visualize_spectrum(self):
-        BANDS = 30
+    def visualize_spectrum(self, spectrum):
+        BANDS = len(self._viz_bars)
         max_freq = 1000
-        max_bin = int(max_freq * self.chunk_size / self.sample_rate)
-        spectrum = np.log(self.spectrum[:max_bin] + 1e-10)
-        chunk_size = len(spectrum) // BANDS
+        max_bin = int(max_freq * self.analysis_size / self.sample_rate)
+        chunk_size = min(max_bin, len(spectrum)) // BANDS
         if chunk_size == 0:
             return
-        bars = []
-        for i in range(BANDS):
-            band = spectrum[i*chunk_size:(i+1)*chunk_size]
-            bars.append(int(np.mean(band) * 2))
+        _bars(spectrum, BANDS, chunk_size, self._viz_bars)
         scale = "▁▂▃▄▅▆▇"
-        visualization = "".join([scale[min(v//2, len(scale)-1)] for v in bars])
+        visualization = "".join(scale[min(v//2, len(scale)-1)] for v in self._viz_bars.tolist())
         print(f"\033[F\033[K{visualization}")
 
     def trigger_action(self, freq):
         action = self.note_map[freq]
-        action_id = f"{action['type']}_{action['action']}"
-        if action_id not in self.active_actions:
+        bit = 1 << self._action_bits[(action['type'], action['action'])]
+        if not self._active_mask & bit:
             if action['type'] == 'key':
                 self.keyboard.press(action['action'])
             elif action['type'] == 'mouse':
-                btn = Button.left if action['action'] == 'left' else Button.right
-                self.mouse.press(btn)
-            self.active_actions.add(action_id)
+                self.mouse.press(self._btn[action['action']])
+            self._active_mask |= bit
 
     def release_actions(self):
-        for action_id in list(self.active_actions):
-            parts = action_id.split('_')
-            if parts[0] == 'key':
-                self.keyboard.release(parts[1])
-            elif parts[0] == 'mouse':
-                btn = Button.left if parts[1] == 'left' else Button.right
-                self.mouse.release(btn)
-            self.active_actions.remove(action_id)
+        mask = self._active_mask
+        while mask:
+            bit = mask & -mask
+            action_type, action = self._action_by_bit[bit.bit_length() - 1]
+            if action_type == 'key':
+                self.keyboard.release(action)
+            elif action_type == 'mouse':
+                self.mouse.release(self._btn[action])
+            mask ^= bit
+        self._active_mask = 0
 
     def display_note(self, freq):
         note_info = self.note_display.get(freq, ("", "", ""))